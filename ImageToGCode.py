@@ -1,9 +1,19 @@
 from PIL import Image
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.collections import LineCollection
 import tkinter as tk
 from tkinter import filedialog, messagebox
+from concurrent.futures import ThreadPoolExecutor
+from tk_preview import show_preview
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional, fall back to the NumPy hatcher
+    njit = None
+
+try:
+    from hatch_kernel import hatch_core as _hatch_ext
+except ImportError:  # compiled kernel is optional too, see hatch_kernel.pyx
+    _hatch_ext = None
 
 
 # SETUP:
@@ -12,7 +22,7 @@ PAGE_WIDTH = 135     # may need to be reduced to 130mm
 PAGE_HEIGHT = 210
 FEED_RATE = 800      # may be increased
 STEP = 0.5           # may be increased depending on pen width
-PREVIEW_WIDTH = 300  # preview with matplotlib
+PREVIEW_WIDTH = 300  # preview width in pixels, drawn at 2x
 PEN_DOWN = "M3;S0"   # depending on servo S40
 PEN_UP = "M5;S180"   # depending on servo S140
 
@@ -22,34 +32,119 @@ def scale_image(img, max_width, max_height):
     w, h = img.size
     scale = min(max_width / w, max_height / h)
     new_size = (int(w * scale), int(h * scale))
-    return img.resize(new_size, Image.Resampling.LANCZOS)
-
-def generate_hatch_lines(img_array, spacing_px):
-    lines = []
+    # reducing_gap box-reduces by floor(ratio / 3) first, LANCZOS still filters the
+    # remaining 3-6x; below a 6x downscale nothing is reduced
+    return img.resize(new_size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+_hatch_core = None
+if njit is not None:
+    _ALL_ON = np.uint64(0x0101010101010101)  # eight True bytes
+
+    @njit(cache=True, nogil=True)
+    def _emit_run(out, n, y_row, x_start, x_end):
+        if x_end > x_start:
+            out[n, 0] = x_start
+            out[n, 1] = y_row[x_start]
+            out[n, 2] = x_end
+            out[n, 3] = y_row[x_end]
+            n += 1
+        return n
+
+    @njit(cache=True, nogil=True)
+    def _scan_row(row, words, y_row, out, n):
+        # words is row seen 8 pixels at a time, a word that is all blank outside
+        # a run or all set inside one cannot start or end a run and is skipped
+        run_start = -1
+        for w in range(words.size):
+            q = words[w]
+            if q == 0 and run_start < 0:
+                continue
+            if q == _ALL_ON and run_start >= 0:
+                continue
+            for x in range(8 * w, 8 * w + 8):
+                if row[x]:
+                    if run_start < 0:
+                        run_start = x
+                elif run_start >= 0:
+                    n = _emit_run(out, n, y_row, run_start, x - 1)
+                    run_start = -1
+        if run_start >= 0:
+            n = _emit_run(out, n, y_row, run_start, y_row.size - 1)
+        return n
+
+    @njit(cache=True, nogil=True)
+    def _hatch_core(rows, words, y_lut):
+        # serial, a parallel kernel on the G-code worker thread can hang the exit.
+        # A run needs two pixels and a gap, so a diagonal holds at most
+        # (width + 1) // 3 of them: fill one buffer of that size, then trim
+        out = np.empty((rows.shape[0] * ((y_lut.shape[1] + 1) // 3), 4), np.int32)
+        n = 0
+        for i in range(rows.shape[0]):
+            n = _scan_row(rows[i], words[i], y_lut[i], out, n)
+        return out[:n].copy()
+
+def diagonal_rows(mask, offsets, align=1):
+    # row i holds the hatch line x + y = offsets[i] as a contiguous run of pixels,
+    # y_lut maps (row, x) back to the image row; rows are padded with blank
+    # pixels to a multiple of align
+    height, width = mask.shape
+    x_all = np.arange(width)
+    y_lut = offsets[:, None] - x_all
+    on_page = (y_lut >= 0) & (y_lut < height)
+    rows = np.zeros((len(offsets), -(-width // align) * align), dtype=bool)
+    rows[:, :width][on_page] = mask[y_lut[on_page], np.broadcast_to(x_all, y_lut.shape)[on_page]]
+    return rows, y_lut
+
+def generate_hatch_lines(img_array, spacing_px, threshold=0.95):
+    # img_array is the raw uint8 image, threshold is a fraction of white
     height, width = img_array.shape
+    mask = img_array < np.uint8(np.ceil(threshold * 255))
     max_offset = width + height
-    for offset in np.arange(0, max_offset, spacing_px):
-        line_points = []
-        for x in range(width):
-            y = int(offset - x)
-            if 0 <= y < height:
-                density = 1 - img_array[y, x]
-                if density > 0.05:
-                    line_points.append((x, y))
-                else:
-                    if len(line_points) > 1:
-                        lines.append((line_points[0], line_points[-1]))
-                    line_points = []
-        if len(line_points) > 1:
-            lines.append((line_points[0], line_points[-1]))
+    # whole pixel offsets, a fractional spacing only rescanned the same diagonals
+    spacing_px = max(1, int(round(spacing_px)))
+    offsets = np.arange(0, max_offset, spacing_px, dtype=np.int64)
+    if _hatch_ext is not None:
+        return _hatch_ext(mask.view(np.uint8), offsets)
+    if _hatch_core is not None:
+        # whole 64 bit words per row so the kernel can skip 8 pixels at once
+        rows, y_lut = diagonal_rows(mask, offsets, align=8)
+        return _hatch_core(rows, rows.view(np.uint64), y_lut)
+    # all diagonals in one diff, nonzero walks them row by row so the
+    # i-th start and the i-th end belong to the same run
+    rows, y_lut = diagonal_rows(mask, offsets)
+    d = np.diff(rows.view(np.int8), axis=1, prepend=0, append=0)
+    row, starts = np.nonzero(d == 1)
+    ends = np.nonzero(d == -1)[1] - 1
+    keep = ends > starts
+    row, starts, ends = row[keep], starts[keep], ends[keep]
+    return np.column_stack((starts, y_lut[row, starts], ends, y_lut[row, ends])).astype(np.int32)
+
+def merge_hatch_lines(lines, max_gap=1):
+    # join runs on the same diagonal separated by at most max_gap blank pixels,
+    # lines must be ordered by offset then x as generate_hatch_lines returns them
+    if len(lines) < 2:
+        return lines
+    prev, nxt = lines[:-1], lines[1:]
+    step = nxt[:, 0] - prev[:, 2]
+    join = (nxt[:, 0] + nxt[:, 1] == prev[:, 0] + prev[:, 1]) & (step > 0) & (step <= max_gap + 1)
+    first = np.flatnonzero(np.concatenate(([True], ~join)))
+    last = np.append(first[1:] - 1, len(lines) - 1)
+    return np.column_stack((lines[first, :2], lines[last, 2:]))
+
+def alternate_hatch_lines(lines):
+    # reverse every other non-empty diagonal, runs and direction, so the pen
+    # snakes across the page instead of travelling back to one side per line
+    if len(lines) < 2:
+        return lines
+    offset = lines[:, 0] + lines[:, 1]
+    _, diag = np.unique(offset, return_inverse=True)
+    back = diag % 2 == 1
+    order = np.lexsort((np.where(back, -lines[:, 0], lines[:, 0]), offset))
+    lines, back = lines[order], back[order]
+    lines[back] = lines[back][:, [2, 3, 0, 1]]
     return lines
 
-def pixel_to_mm(x, y, img_width, img_height, page_width, page_height):
-    scale_x = page_width / img_width
-    scale_y = page_height / img_height
-    return x * scale_x, y * scale_y
-
-def show_hatch_preview(img_array, step_px=6):
+def show_hatch_preview(img_array, step_px=6, zoom=2):
     gray = img_array.astype(float)
     gray -= gray.min()
     if gray.max() > 0:
@@ -57,72 +152,79 @@ def show_hatch_preview(img_array, step_px=6):
     norm = gray
 
     height, width = img_array.shape
-    fig, ax = plt.subplots(figsize=(6, 8))
-    ax.set_xlim(0, width)
-    ax.set_ylim(height, 0)
-    ax.set_aspect('equal')
-    ax.axis("off")
-
-    segments = []
-    for y in range(0, height, step_px):
-        for x in range(0, width, step_px):
-            density = 1 - norm[y, x]
-            lines = max(1, int(1 + 3 * density))
-            for i in range(lines):
-                segments.append([(x, y + i), (x + step_px, y + i + step_px)])
-
-    if segments:
-        lc = LineCollection(segments, colors='black', linewidths=0.4, alpha=0.8)
-        ax.add_collection(lc)
+
+    # one cell per grid point, darker cells get up to 4 stacked strokes
+    ys, xs = np.mgrid[0:height:step_px, 0:width:step_px]
+    density = 1 - norm[ys, xs]
+    counts = np.maximum(1, (1 + 3 * density).astype(int)).ravel()
+    x = np.repeat(xs.ravel(), counts)
+    y = np.repeat(ys.ravel(), counts)
+    y = y + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    segments = np.stack((x, y, x + step_px, y + step_px), axis=1)
 
     edges = np.zeros_like(norm)
     edges[1:-1, 1:-1] = np.abs(norm[1:-1, 1:-1] - norm[0:-2, 1:-1]) + \
                         np.abs(norm[1:-1, 1:-1] - norm[1:-1, 0:-2])
     edge_coords = np.argwhere(edges > 0.05)
-    for y, x in edge_coords:
-        ax.plot([x, x+0.5], [y, y+0.5], color='black', linewidth=0.4)
+    edge_segs = np.tile(edge_coords[:, ::-1], 2) + [0, 0, 0.5, 0.5]  # (y, x) -> (x, y, x+.5, y+.5)
 
-    plt.title("Hatch Preview")
-    plt.tight_layout()
-    plt.show()
+    show_preview(np.concatenate((segments, edge_segs)), width, height, zoom, "Hatch Preview")
 
 def generate_gcode(img, output_file):
-    img = scale_image(img, PAGE_WIDTH, PAGE_HEIGHT)
-    img_array = np.array(img)
+    # img is already scaled to the page with scale_image
+    img_array = np.asarray(img, dtype=np.uint8)
     img_width, img_height = img.size
 
-    lines = generate_hatch_lines(img_array / 255.0, spacing_px=STEP)
+    lines = alternate_hatch_lines(merge_hatch_lines(generate_hatch_lines(img_array, spacing_px=STEP)))
+
+    # pixel -> mm for all endpoints at once, columns are x0, y0, x1, y1
+    scale_x = PAGE_WIDTH / img_width
+    scale_y = PAGE_HEIGHT / img_height
+    lines_mm = lines * np.array([scale_x, scale_y, scale_x, scale_y])
 
-    with open(output_file, "w") as f:
-        f.write("G21 ; set units to mm\n")
-        f.write("G90 ; absolute positioning\n")
-        for start, end in lines:
-            x0, y0 = pixel_to_mm(start[0], start[1], img_width, img_height, PAGE_WIDTH, PAGE_HEIGHT)
-            x1, y1 = pixel_to_mm(end[0], end[1], img_width, img_height, PAGE_WIDTH, PAGE_HEIGHT)
-            f.write(f"G0 X{x0:.2f} Y{y0:.2f}\n")
-            f.write(f"{PEN_DOWN}\n")
-            f.write(f"G1 X{x1:.2f} Y{y1:.2f} F{FEED_RATE}\n")
-            f.write(f"{PEN_UP}\n")
+    # bytes formatting straight into one buffer, no str join or text encoding
+    segment = f"G0 X%.2f Y%.2f\n{PEN_DOWN}\nG1 X%.2f Y%.2f F{FEED_RATE}\n{PEN_UP}\n".encode()
+    gcode = bytearray(b"G21 ; set units to mm\nG90 ; absolute positioning\n")
+    for coords in lines_mm.tolist():
+        gcode += segment % tuple(coords)
+
+    with open(output_file, "wb") as f:
+        f.write(gcode)
 
 
 # GUI:
 
+executor = ThreadPoolExecutor(max_workers=2)
+
+def when_done(future, callback):
+    # poll from the Tk loop, Tk must only be touched from the main thread;
+    # worker errors go to a message box, the windowed exe has no console
+    if not future.done():
+        root.after(100, when_done, future, callback)
+        return
+    try:
+        callback(future.result())
+    except Exception as e:
+        messagebox.showerror("Error", str(e))
 
 def select_image():
     file_path = filedialog.askopenfilename(filetypes=[("Image files", "*.png *.jpg *.jpeg")])
     if file_path:
         img = Image.open(file_path).convert("L")
         preview_height = int(PREVIEW_WIDTH * img.height / img.width)
-        preview_img = img.resize((PREVIEW_WIDTH, preview_height), Image.Resampling.LANCZOS)
-        preview_array = np.array(preview_img)
+        preview_img = img.resize((PREVIEW_WIDTH, preview_height), Image.Resampling.LANCZOS, reducing_gap=3.0)
+        # the page image is never wider than the preview, so shrink the preview
+        # instead of running LANCZOS over the full-size original a second time
+        page_img = scale_image(preview_img, PAGE_WIDTH, PAGE_HEIGHT)
+        preview_array = np.asarray(preview_img, dtype=np.uint8)
 
         show_hatch_preview(preview_array)
         output_file = filedialog.asksaveasfilename(defaultextension=".gcode",
                                                    filetypes=[("G-code files", "*.gcode")],
                                                    initialfile="output.gcode")
         if output_file:
-            generate_gcode(img, output_file)
-            messagebox.showinfo("Yey, fertig!", f"G-code gespeichert: {output_file}")
+            future = executor.submit(generate_gcode, page_img, output_file)
+            when_done(future, lambda _: messagebox.showinfo("Yey, fertig!", f"G-code gespeichert: {output_file}"))
 
 root = tk.Tk()
 root.title("dRawbot GCode-Generator")
@@ -0,0 +1,290 @@
+# Line generation and G-code output shared by ImageToGCode2.py and InkscapeToGCode.py.
+# Images are uint8 greyscale arrays (0 black .. 255 white), segments are (N, 2, 2)
+# arrays of ((x0, y0), (x1, y1)) in pixels until generate_gcode maps them to mm.
+import numpy as np
+try:
+    import contourpy
+except ImportError:  # contourpy is optional, scikit-image is the fallback
+    contourpy = None
+    from skimage import measure
+try:
+    from numba import njit
+except ImportError:  # numba is optional, block averages fall back to NumPy
+    njit = None
+try:
+    from scipy.spatial import cKDTree
+except ImportError:  # without scipy segments are drawn in generation order
+    cKDTree = None
+
+# ---------------- HELPERS ----------------
+
+def pixel_to_mm(x, y, img_w_px, img_h_px, printed_w_mm, printed_h_mm):
+    """Map pixel coordinates (scalars or arrays) to mm within the printed area. Flip Y so origin is bottom-left."""
+    sx = printed_w_mm / img_w_px
+    sy = printed_h_mm / img_h_px
+    return x * sx, (img_h_px - y) * sy
+
+# ---------------- LINE GENERATION ----------------
+
+def find_contours(img_array):
+    """
+    Polylines where img_array (uint8) crosses mid-grey, as a list of (N, 2) arrays of (x, y).
+    Saddle cells (diagonal pixel pairs) join the white regions, as tracing the inverted image did.
+    """
+    if contourpy is not None:
+        # contourpy has no saddle option, trace the inverted image like before
+        gen = contourpy.contour_generator(z=255 - img_array, line_type=contourpy.LineType.Separate)
+        return gen.lines(127.5)
+    # scikit-image gives (row,col) -> (x,y)
+    return [c[:, ::-1] for c in measure.find_contours(img_array, 127.5, fully_connected="high")]
+
+def simplify_polyline(pts, tolerance):
+    """Douglas-Peucker: keep only the points of pts further than tolerance (px) from the simplified line."""
+    if tolerance <= 0 or len(pts) < 3:
+        return pts
+    keep = np.zeros(len(pts), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(pts) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        chord = pts[last] - pts[first]
+        rel = pts[first + 1:last] - pts[first]
+        length = np.hypot(chord[0], chord[1])
+        if length > 0:
+            dist = np.abs(chord[0] * rel[:, 1] - chord[1] * rel[:, 0]) / length
+        else:  # closed contour, measure from the shared end point
+            dist = np.hypot(rel[:, 0], rel[:, 1])
+        i = np.argmax(dist)
+        if dist[i] > tolerance:
+            mid = first + 1 + i
+            keep[mid] = True
+            stack += [(first, mid), (mid, last)]
+    return pts[keep]
+
+def generate_outline(img_array, tolerance=0.0):
+    """
+    Return (N, 2, 2) float32 array of line segments from contours. img_array is uint8 greyscale (0 black .. 255 white).
+    Contours are simplified to within tolerance pixels first.
+    """
+    contours = [simplify_polyline(c, tolerance) for c in find_contours(img_array)]
+    segs = [np.stack((c[:-1], c[1:]), axis=1) for c in contours]
+    return np.concatenate(segs).astype(np.float32) if segs else np.empty((0, 2, 2), np.float32)
+
+def generate_fill_lines_bw(img_array, spacing_px):
+    """
+    Black & white fill: merge horizontal runs into segments. spacing_px is vertical step in pixels.
+    Returns an (N, 2, 2) int32 array of ((x0, y), (x1, y)) pixel segments.
+    """
+    step = max(1, int(spacing_px))
+    mask = img_array[::step] < 128
+    width = mask.shape[1]
+    # 8 pixels per byte, first pixel in the high bit; a tr bit is set where a
+    # pixel differs from the one before it (the pixel before x = 0 is white)
+    bits = np.packbits(mask, axis=1)
+    carry = np.zeros_like(bits)
+    carry[:, 1:] = bits[:, :-1] << 7
+    tr = bits ^ ((bits >> 1) | carry)
+    # only rows with a transition hold ink, the rest are never unpacked
+    inked = np.flatnonzero(tr.any(axis=1))
+    rows, xs = np.nonzero(np.unpackbits(tr[inked], axis=1, count=width))
+    # transitions alternate start / one-past-end; a run still open at the
+    # right border gets its closing transition at width
+    open_rows = np.flatnonzero(np.bincount(rows, minlength=len(inked)) % 2)
+    rows = np.concatenate((rows, open_rows))
+    xs = np.concatenate((xs, np.full(len(open_rows), width)))
+    order = np.argsort(rows * (width + 1) + xs, kind="stable")
+    rows, xs = rows[order], xs[order]
+    starts, ends = xs[0::2], xs[1::2] - 1
+    y = inked[rows[0::2]] * step
+    return np.stack((starts, y, ends, y), axis=1).reshape(-1, 2, 2).astype(np.int32)
+
+def merge_collinear(segs, line_key):
+    """
+    Union the segments of each line (equal line_key): segments that overlap, touch or repeat are
+    joined into one, so overlapping blocks do not draw the same stretch twice. Segments must run
+    left to right (x0 < x1). Returns the merged (M, 2, 2) array ordered by line, then x.
+    """
+    if len(segs) < 2:
+        return segs
+    order = np.lexsort((segs[:, 0, 0], line_key))
+    segs, line_key = segs[order], np.asarray(line_key)[order]
+    x0 = segs[:, 0, 0].astype(np.float64)
+    x1 = segs[:, 1, 0].astype(np.float64)
+    # furthest x1 reached so far on each line; every line is lifted above the
+    # one before it so a single running maximum does not leak between lines
+    new_line = np.concatenate(([True], line_key[1:] != line_key[:-1]))
+    lift = np.cumsum(new_line) * (x1.max() - x0.min() + 1)
+    reach = np.maximum.accumulate(x1 + lift) - lift
+    join = ~new_line[1:] & (x0[1:] <= reach[:-1] + 1e-9)
+    first = np.flatnonzero(np.concatenate(([True], ~join)))
+    last = np.append(first[1:] - 1, len(segs) - 1)
+    # each group runs from its first start to its furthest end, along the line's slope
+    start = segs[first, 0].astype(np.float64)
+    slope = (segs[first, 1, 1] - segs[first, 0, 1]) / (segs[first, 1, 0] - segs[first, 0, 0])
+    end_x = reach[last]
+    end = np.stack((end_x, start[:, 1] + (end_x - start[:, 0]) * slope), axis=1)
+    return np.stack((start, end), axis=1).astype(segs.dtype)
+
+_block_core = None
+if njit is not None:
+    # serial on purpose: the preview and the full-size lines call this from two
+    # threads at once, which Numba's workqueue layer aborts on in parallel mode
+    @njit(cache=True, nogil=True)
+    def _block_core(img_array, step, bs):
+        # sums each block directly, no (h+1) x (w+1) float64 table
+        h, w = img_array.shape
+        ny = (h + step - 1) // step
+        nx = (w + step - 1) // step
+        avg = np.empty((ny, nx))
+        for by in range(ny):
+            y = by * step
+            y_end = min(y + bs, h)
+            for bx in range(nx):
+                x = bx * step
+                x_end = min(x + bs, w)
+                total = 0.0
+                for yy in range(y, y_end):
+                    for xx in range(x, x_end):
+                        total += img_array[yy, xx]
+                avg[by, bx] = 1.0 - total / (255.0 * (y_end - y) * (x_end - x))
+        return avg
+
+def block_darkness(img_array, step, bs):
+    """Mean blackness (0..1) of the bs x bs block of a uint8 image at every step-th pixel; edge blocks are clipped."""
+    if _block_core is not None:
+        return _block_core(img_array, step, bs)
+    h, w = img_array.shape
+    ys = np.arange(0, h, step)
+    xs = np.arange(0, w, step)
+    # block sums from a summed-area table
+    sat = np.zeros((h + 1, w + 1))
+    sat[1:, 1:] = img_array.cumsum(axis=0, dtype=np.float64).cumsum(axis=1)
+    y_end = np.minimum(ys + bs, h)
+    x_end = np.minimum(xs + bs, w)
+    sums = (sat[np.ix_(y_end, x_end)] - sat[np.ix_(ys, x_end)]
+            - sat[np.ix_(y_end, xs)] + sat[np.ix_(ys, xs)])
+    return 1.0 - sums / (255.0 * np.outer(y_end - ys, x_end - xs))
+
+def generate_density_hatch_blocks(img_array, step_px, max_lines_per_block=4, diagonal=False, block_size=4):
+    """
+    Greyscale hatch using averaged blocks to reduce density.
+    step_px = pixel spacing (vertical) for blocks.
+    block_size = pixels used to compute average darkness.
+    Returns an (N, 2, 2) float32 array of pixel segments.
+    """
+    step = max(1, int(step_px))
+    bs = max(1, int(block_size))
+
+    # only blocks overlapping a non-white pixel can get lines, crop to those
+    ink = img_array < 255
+    ink_rows = np.flatnonzero(ink.any(axis=1))
+    ink_cols = np.flatnonzero(ink.any(axis=0))
+    if not len(ink_rows):
+        return np.empty((0, 2, 2), np.float32)
+    by0 = max(0, -(-(ink_rows[0] - bs + 1) // step))
+    bx0 = max(0, -(-(ink_cols[0] - bs + 1) // step))
+    img_array = img_array[by0 * step:ink_rows[-1] // step * step + bs,
+                          bx0 * step:ink_cols[-1] // step * step + bs]
+
+    h, w = img_array.shape
+    ys = by0 * step + np.arange(0, h, step)
+    xs = bx0 * step + np.arange(0, w, step)
+
+    avg = block_darkness(img_array, step, bs)  # 0..1 blackness
+    num = np.rint(avg * max_lines_per_block).astype(int)
+
+    # one entry per line, i counts the lines inside each block
+    by, bx = np.nonzero(num > 0)
+    per_block = num[by, bx]
+    by = np.repeat(by, per_block)
+    bx = np.repeat(bx, per_block)
+    i = np.arange(per_block.sum()) - np.repeat(np.cumsum(per_block) - per_block, per_block)
+
+    x0 = xs[bx]
+    y0 = ys[by] + (i + 0.5) * (bs / max_lines_per_block)  # center within block
+    y1 = y0 + step if diagonal else y0
+    segs = np.stack((x0, y0, x0 + step, y1), axis=1).reshape(-1, 2, 2).astype(np.float32)
+    return merge_collinear(segs, y0 - x0 if diagonal else y0)
+
+# ---------------- GCODE OUTPUT ----------------
+
+def order_segments(segs):
+    """
+    Greedy nearest-neighbour drawing order for an (N, 2, 2) array of segments, starting at the origin.
+    Segments may be reversed so the pen starts at the closer end. Cuts pen-up travel.
+    """
+    n = len(segs)
+    if n < 2 or cKDTree is None:
+        return segs
+    pts = segs.reshape(-1, 2)  # endpoint 2*i starts segment i, 2*i+1 ends it
+    done = np.zeros(n, dtype=bool)
+    order = np.empty(n, dtype=np.int64)
+    flip = np.zeros(n, dtype=bool)
+    live = np.arange(2 * n)
+    tree = cKDTree(pts)
+    pos = np.zeros(2)
+    for k in range(n):
+        near = 16
+        while True:
+            _, hits = tree.query(pos, k=min(near, len(live)))
+            cand = live[np.atleast_1d(hits)]
+            cand = cand[~done[cand // 2]]
+            if len(cand):
+                break
+            if near >= 256:  # neighbourhood used up, rebuild the tree over what is left
+                live = np.flatnonzero(np.repeat(~done, 2))
+                tree = cKDTree(pts[live])
+                near = 16
+            else:
+                near *= 4
+        j = cand[0]
+        done[j // 2] = True
+        order[k] = j // 2
+        flip[k] = j % 2 == 1
+        pos = pts[j ^ 1]
+    out = segs[order]
+    out[flip] = out[flip, ::-1]
+    return out
+
+def generate_gcode(img_px, lines_px, output_path, printed_w_mm, printed_h_mm,
+                   feed_rate=2000, pen_down="M3;S0", pen_up="M5;S180", skip_tiny_move_mm=0.01):
+    """
+    Write the (N, 2, 2) pixel segments of img_px (a PIL image, only its size is used) as G-code,
+    stretched over printed_w_mm x printed_h_mm. Segments that chain up are drawn without lifting the pen.
+    """
+    img_w_px, img_h_px = img_px.size
+    # all endpoints to mm in one go, segs_mm[i] = ((x0, y0), (x1, y1))
+    x_mm, y_mm = pixel_to_mm(lines_px[..., 0], lines_px[..., 1], img_w_px, img_h_px, printed_w_mm, printed_h_mm)
+    segs_mm = np.stack((x_mm, y_mm), axis=-1)
+
+    # skip micro-moves
+    d = np.abs(segs_mm[:, 1] - segs_mm[:, 0])
+    segs_mm = segs_mm[(d[:, 0] >= skip_tiny_move_mm) | (d[:, 1] >= skip_tiny_move_mm)]
+    segs_mm = order_segments(segs_mm)
+    # segments that start where the previous one ended form one polyline:
+    # the pen stays down and only their G1 moves are written
+    ends = np.round(segs_mm, 3)
+    rapid = np.ones(len(segs_mm), dtype=bool)
+    rapid[1:] = np.any(ends[1:, 0] != ends[:-1, 1], axis=1)
+
+    # templates carry the pen commands and feed rate, the loop only formats coordinates
+    lift = f"{pen_up}\n"
+    travel = f"G0 X%.2f Y%.2f\n{pen_down}\n"
+    hop = lift + travel  # lift, travel to the next polyline, lower
+    draw = f"G1 X%.2f Y%.2f F{feed_rate}\n"
+    gcode = [f"; Image size (scaled): {printed_w_mm:.2f} x {printed_h_mm:.2f} mm ({img_w_px}x{img_h_px} px)\n",
+             "G21 ; mm units\nG90 ; absolute positioning\n"]
+    rows = segs_mm.reshape(-1, 4).tolist()
+    if rows:
+        append = gcode.append
+        append(travel % (rows[0][0], rows[0][1]))
+        rapid[0] = False
+        for (x0, y0, x1, y1), r in zip(rows, rapid.tolist()):
+            if r:
+                append(hop % (x0, y0))
+            append(draw % (x1, y1))
+        append(lift)
+    with open(output_path, "w") as f:
+        f.write("".join(gcode))
@@ -0,0 +1,49 @@
+# cython: boundscheck=False, wraparound=False, cdivision=True
+#
+# Optional compiled hatch extractor for ImageToGCode.py, build in place with
+#   cythonize -i hatch_kernel.pyx
+# ImageToGCode.py falls back to Numba or NumPy when this module is missing.
+
+import numpy as np
+
+
+def hatch_core(const unsigned char[:, ::1] mask, const long long[::1] offsets):
+    # same runs as the Numba kernel: one (x0, y0, x1, y1) row per run of
+    # at least two mask pixels along x + y = offset
+    cdef Py_ssize_t height = mask.shape[0]
+    cdef Py_ssize_t width = mask.shape[1]
+    cdef Py_ssize_t i, x, x_end, run_start = 0, run_len
+    cdef Py_ssize_t y, n = 0
+    cdef long long offset
+    cdef bint inside
+
+    # a run needs two pixels and a gap, so a diagonal holds at most (width + 1) // 3
+    lines = np.empty((offsets.shape[0] * ((width + 1) // 3), 4), np.int32)
+    cdef int[:, ::1] out = lines
+
+    with nogil:
+        for i in range(offsets.shape[0]):
+            offset = offsets[i]
+            run_len = 0
+            for x in range(width + 1):
+                inside = False
+                if x < width:
+                    y = offset - x
+                    if y < 0 or y >= height:
+                        continue
+                    inside = mask[y, x] != 0
+                if inside:
+                    if run_len == 0:
+                        run_start = x
+                    run_len += 1
+                else:
+                    if run_len > 1:
+                        x_end = run_start + run_len - 1
+                        out[n, 0] = <int>run_start
+                        out[n, 1] = <int>(offset - run_start)
+                        out[n, 2] = <int>x_end
+                        out[n, 3] = <int>(offset - x_end)
+                        n += 1
+                    run_len = 0
+
+    return lines[:n].copy()
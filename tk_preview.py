@@ -0,0 +1,31 @@
+# Preview window shared by the GUI scripts: pixel segments are rasterized with
+# PIL and shown in a single Toplevel that is reused for every image.
+import tkinter as tk
+from PIL import Image, ImageDraw, ImageTk
+
+_preview = None  # (window, label), built once and reused for every image
+
+def preview_label(title="Preview"):
+    """The preview window's image label, creating the window on first use."""
+    global _preview
+    if _preview is None:
+        window = tk.Toplevel()
+        window.protocol("WM_DELETE_WINDOW", window.withdraw)  # hide, keep for the next image
+        label = tk.Label(window, bg="white")
+        label.pack(fill=tk.BOTH, expand=True)
+        _preview = window, label
+    window, label = _preview
+    window.title(title)
+    window.deiconify()
+    return label
+
+def show_preview(lines, width_px, height_px, zoom=2, title="Preview"):
+    """Rasterize the pixel segments, (N, 2, 2) or (N, 4), zoom times enlarged and show them."""
+    canvas = Image.new("L", (round(width_px * zoom), round(height_px * zoom)), 255)
+    draw = ImageDraw.Draw(canvas)
+    for seg in (lines.reshape(-1, 4) * zoom).tolist():
+        draw.line(seg, fill=0)
+    photo = ImageTk.PhotoImage(canvas)
+    label = preview_label(title)
+    label.configure(image=photo)
+    label.image = photo  # Tk does not hold a reference to the image